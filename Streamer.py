@@ -1,29 +1,35 @@
 import cv2
+import multiprocessing
 import os
+import shutil
+import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 frames_dir = 'frames_opencv'
 
 
-def stream_video (video_path: str,
-                  min_width = 640,
-                  min_height=360, max_video_size_gb = 1):
-    
+def _open_capture(video_path: str, hw_accel=True):
+    """
+    Open a VideoCapture, decoding on the GPU's video engine (NVDEC, QSV, VAAPI, ...)
+    when OpenCV's FFmpeg backend supports it and falling back to software decoding otherwise
+    """
+    if hw_accel and hasattr(cv2, "CAP_PROP_HW_ACCELERATION"):
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG,
+                               [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if cap.isOpened():
+            return cap
+    return cv2.VideoCapture(video_path)
+
+
+def _open_video(video_path: str, max_video_size_gb = 1, hw_accel=True):
+    """Open a video for reading, raising an error if it is missing, too large or unreadable"""
     if not os.path.exists(video_path):
        raise FileNotFoundError(f"{video_path} not found.")
     
-    filename = os.path.basename(video_path)
-    output_path = os.path.join(frames_dir, filename)
-    
-    # Checks if the video was already converted to frames
-    if os.path.isdir(output_path) and os.listdir(output_path):
-        print(f"[Info] Frames already exist in {output_path}. Skipping extraction.")
-        return 
-    
-    os.makedirs(output_path, exist_ok=True)
-    
     # Calculate the video size and Raise an error if the video is too large
-    size_bytes = os.path.getsize('dog_video.MP4')
+    size_bytes = os.path.getsize(video_path)
     size_gb = size_bytes / (1024 ** 3)
     
     if size_gb > max_video_size_gb:
@@ -31,66 +37,285 @@ def stream_video (video_path: str,
         
 
     # Raise errors if the video can't be opened corectly    
-    cap = cv2.VideoCapture(video_path)
+    cap = _open_capture(video_path, hw_accel)
     if not cap.isOpened():
         raise IOError("Could not open video.")
 
     fps = cap.get(cv2.CAP_PROP_FPS)
     if fps == 0:
+        cap.release()
         raise ValueError("FPS is zero — unsupported or corrupted file.")    
     
+    return cap
+
+
+def stream_video (video_path: str,
+                  min_width = 640,
+                  min_height=360, max_video_size_gb = 1, persist=False, hw_accel=True):
+    """
+    Decode a video and yield its frames one by one
+    
+    Parameters:
+    video_path (str): Path to the video file
+    max_video_size_gb (float): Maximum allowed size of the video file
+    persist (bool): Whether to also save every frame as a JPEG under frames_dir
+    hw_accel (bool): Whether to try hardware decoding before falling back to the CPU
+    
+    Returns:
+    generator: (frame_number, frame) pairs, frame being a BGR numpy.ndarray
+    """
+    cap = _open_video(video_path, max_video_size_gb, hw_accel)
+    
+    output_path = None
+    if persist:
+        output_path = os.path.join(frames_dir, os.path.basename(video_path))
+        os.makedirs(output_path, exist_ok=True)
+    
+    # The checks above run eagerly, the decoding itself is lazy
+    return _read_video(cap, output_path)
+
+
+def _write_frame(path, frame, pending_writes, errors):
+    """Save one frame as a JPEG and free its slot in the write queue, recording any failure"""
+    try:
+        if not cv2.imwrite(path, frame):
+            raise IOError(f"Could not write frame: {path}")
+    except Exception as e:
+        # Hand the error over to the decode loop, which raises it
+        errors.append(e)
+    finally:
+        pending_writes.release()
+
+
+def _read_video(cap, output_path=None, max_pending_writes=16):
+    """Yield (frame_number, frame) from an opened capture, saving JPEGs to output_path if given"""
     idx = 0
     consecutive_skipped = 0
     max_consecutive_skips = 4
     max_retries_per_frame = 3
     frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     
-    while True:
-        success, frame = cap.read()
+    # Encode the JPEGs on a thread pool so decoding doesn't wait for them,
+    # with at most max_pending_writes frames held in memory
+    executor = None
+    write_errors = []
+    if output_path:
+        executor = ThreadPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) // 2))
+        pending_writes = threading.BoundedSemaphore(max_pending_writes)
+    
+    try:
+        while True:
+            success, frame = cap.read()
         
-        if not success:
-            if idx < frame_count:
-                retry_count = 0
-                backoff = 1
-                # Adds exponential backoff if a frame fails 
-                while retry_count < max_retries_per_frame:
-                    print(f"[Warning] Failed to read frame {idx}. Retrying in {backoff} second(s)...")
-                    time.sleep(backoff)
-                    retry_count += 1
-                    backoff *= 2  # exponential backoff
-                    success, frame = cap.read()
-                    if success:
-                        break
+            if not success:
+                if idx < frame_count:
+                    retry_count = 0
+                    backoff = 1
+                    # Adds exponential backoff if a frame fails 
+                    while retry_count < max_retries_per_frame:
+                        print(f"[Warning] Failed to read frame {idx}. Retrying in {backoff} second(s)...")
+                        time.sleep(backoff)
+                        retry_count += 1
+                        backoff *= 2  # exponential backoff
+                        success, frame = cap.read()
+                        if success:
+                            break
                 
-                if not success:
-                    print(f"[Error] Skipping frame {idx} after {max_retries_per_frame} retries.")
-                    consecutive_skipped += 1
-                    if consecutive_skipped >= max_consecutive_skips:
-                        raise RuntimeError("Too many consecutive frame failures. Aborting.")
-                    idx += 1
-                    continue
+                    if not success:
+                        print(f"[Error] Skipping frame {idx} after {max_retries_per_frame} retries.")
+                        consecutive_skipped += 1
+                        if consecutive_skipped >= max_consecutive_skips:
+                            raise RuntimeError("Too many consecutive frame failures. Aborting.")
+                        idx += 1
+                        continue
+                    else:
+                        consecutive_skipped = 0
                 else:
-                    consecutive_skipped = 0
-            else:
-                break
+                    break
         
-        # Only try to save if we have a valid frame
-        if success:
+            # Only try to hand over the frame if we have a valid one
+            if success:
             
-            # Save the frame
-            cv2.imwrite(os.path.join(output_path, f"frame_{idx:05d}.jpg"), frame)
-            idx += 1
-            if idx % 100 == 0 and idx > 0:
-                print(f"Processed {idx} frames, only {frame_count-idx} left.")
-        
+                # Save the frame only when persisting to disk, the copy keeps the JPEG
+                # intact if the consumer draws on the yielded frame
+                if output_path:
+                    # Stop decoding once a frame failed to save, the error is raised below
+                    if write_errors:
+                        break
+                    pending_writes.acquire()
+                    executor.submit(_write_frame, os.path.join(output_path, f"frame_{idx:05d}.jpg"),
+                                    frame.copy(), pending_writes, write_errors)
+                yield idx, frame
+                idx += 1
+                if idx % 100 == 0 and idx > 0:
+                    print(f"Processed {idx} frames, only {frame_count-idx} left.")
+    finally:
+        if executor:
+            executor.shutdown(wait=True)
+        cap.release()
+        if write_errors:
+            raise write_errors[0]
+
+
+def _keyframe_indices(video_path: str):
+    """
+    Return the frame numbers of the keyframes using ffprobe, or None if it isn't available.
+    Packets come in decode order, which differs from the display order when the stream has
+    B-frames, so they are ranked by presentation timestamp. Without timestamps the decode
+    order is used, and a start can then be off by the few B-frames around a keyframe,
+    which only costs the worker a longer seek.
+    """
+    try:
+        probe = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0",
+                                "-show_entries", "packet=pts,flags", "-of", "csv=p=0", video_path],
+                               capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    packets = [line.split(",")[:2] for line in probe.stdout.split()]
+    if all(pts.lstrip("-").isdigit() for pts, _ in packets):
+        packets.sort(key=lambda packet: int(packet[0]))
+    return [i for i, (_, flags) in enumerate(packets) if "K" in flags]
+
+
+def _split_intervals(frame_count, workers, keyframes=None):
+    """
+    Split the video into up to `workers` intervals, starting on keyframes when known.
+    frame_count is only the container's estimate, so the last interval has no end (None)
+    and is read until the video runs out.
+    """
+    starts = {frame_count * k // workers for k in range(workers)}
+    if keyframes:
+        # Move every start back to the closest keyframe so each worker seeks cheaply
+        starts = {max([kf for kf in keyframes if kf <= s], default=0) for s in starts}
+    starts = sorted(starts)
+    return list(zip(starts, starts[1:] + [None]))
+
+
+def _extract_interval(video_path, output_path, start, end, hw_accel=True):
+    """Worker: decode frames [start, end) of a video, or from start to its last frame if end
+    is None, and save them as JPEGs"""
+    cap = _open_capture(video_path, hw_accel)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    
+    idx = start
+    while end is None or idx < end:
+        success, frame = cap.read()
+        if not success:
+            # The open-ended last interval stops at the end of the video
+            if end is not None:
+                print(f"[Warning] Failed to read frame {idx}, stopping this interval at {idx}/{end}.")
+            break
+        path = os.path.join(output_path, f"frame_{idx:05d}.jpg")
+        if not cv2.imwrite(path, frame):
+            raise IOError(f"Could not write frame: {path}")
+        idx += 1
+    
+    cap.release()
+    return idx - start
+
+
+def extract_frames(video_path: str, workers = 1, **kwargs):
+    """
+    Save every frame of a video as a JPEG under frames_dir
+    
+    Parameters:
+    video_path (str): Path to the video file
+    workers (int): Number of processes decoding the video, each one seeks to its own
+                   keyframe-aligned interval (0 or None to use every core)
+    
+    Returns:
+    str: Directory containing the extracted frames
+    """
+    output_path = os.path.join(frames_dir, os.path.basename(video_path))
+    
+    # Checks if the video was already converted to frames
+    if os.path.isdir(output_path) and os.listdir(output_path):
+        print(f"[Info] Frames already exist in {output_path}. Skipping extraction.")
+        return output_path
+    
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        try:
+            for _ in stream_video(video_path, persist=True, **kwargs):
+                pass
+        except Exception:
+            # Don't leave a partial directory behind, it would be taken as already extracted
+            shutil.rmtree(output_path, ignore_errors=True)
+            raise
+        return output_path
+    
+    hw_accel = kwargs.get("hw_accel", True)
+    cap = _open_video(video_path, kwargs.get("max_video_size_gb", 1), hw_accel)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     cap.release()
-    return output_path 
+    os.makedirs(output_path, exist_ok=True)
+    
+    intervals = _split_intervals(frame_count, workers, _keyframe_indices(video_path))
+    try:
+        with multiprocessing.Pool(len(intervals)) as pool:
+            written = pool.starmap(_extract_interval,
+                                   [(video_path, output_path, start, end, hw_accel)
+                                    for start, end in intervals])
+    except Exception:
+        # Same as above, a partial directory would be taken as already extracted
+        shutil.rmtree(output_path, ignore_errors=True)
+        raise
+    
+    # A worker that stopped early left a gap in the frames, remove them so the next run
+    # extracts the video again instead of skipping it
+    missing = sum(end - start - n for (start, end), n in zip(intervals, written) if end is not None)
+    if missing:
+        shutil.rmtree(output_path, ignore_errors=True)
+        raise RuntimeError(f"Failed to extract {missing} frames of {video_path}.")
+    print(f"Processed {sum(written)} frames with {len(intervals)} workers.")
+    return output_path
+
+
+def _load_frames(frame_paths):
+    """Yield (frame_number, frame) for every frame file that can be read"""
+    for frame_path in frame_paths:
+        # Take the number from the name, frames skipped while extracting leave gaps
+        number = os.path.basename(frame_path)[len("frame_"):-len(".jpg")]
+        if not number.isdigit():
+            print(f"Skipping file without a frame number: {frame_path}")
+            continue
+        i = int(number)
+        frame = cv2.imread(frame_path)
+        
+        if frame is None:
+            print(f"Could not read frame: {frame_path}")
+            continue
+        
+        yield i, frame
+
+
+def read_frames(frames_directory):
+    """
+    Read previously extracted frames back from disk
+    
+    Parameters:
+    frames_directory (str): Directory containing frame images (should be named in sequence)
     
+    Returns:
+    generator: (frame_number, frame) pairs in file name order, loaded lazily
+               (run_pipeline reads them ahead of the detector on its reader thread)
+    """
+    # Get all frame images and sort them, names are zero padded so the
+    # lexicographic order is the frame order
+    with os.scandir(frames_directory) as entries:
+        frame_paths = sorted(entry.path for entry in entries
+                             if entry.name.startswith("frame_") and entry.name.endswith(".jpg"))
+    
+    if len(frame_paths) == 0:
+        print("No frames found in the directory.")
+    
+    return _load_frames(frame_paths)
+
 
 
 
 if __name__ == "__main__":
-    stream_video('dog_video.MP4')
+    extract_frames('dog_video.MP4')
 
    
 
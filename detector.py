@@ -1,97 +1,128 @@
 # import the necessary packages
 import argparse
 import datetime
-import imutils
+import io
 import time
 import cv2
-import os
-import glob
+import numpy as np
+from Streamer import read_frames
 
-def detect_motion_in_frames(frames_directory, min_area=500, display=True):
+# Width of the frames motion is reported on
+FRAME_WIDTH = 500
+# Motion is detected two pyramid levels down, i.e. on a quarter of FRAME_WIDTH
+PYRAMID_LEVELS = 2
+
+def _to_array(image):
+    """Download an image from the OpenCL device if it lives there"""
+    return image.get() if isinstance(image, cv2.UMat) else image
+
+def iter_motion(frames, min_area=500, use_opencl=False):
     """
-    Process a directory of frame images to detect motion
+    Detect motion frame by frame
     
     Parameters:
-    frames_directory (str): Directory containing frame images (should be named in sequence)
+    frames (iterable): (frame_number, frame) pairs such as stream_video() or read_frames()
     min_area (int): Minimum contour area to be considered motion
-    display (bool): Whether to display the processed frames
+    use_opencl (bool): Whether to run the pixel operations on the GPU through OpenCL (cv2.UMat)
     
     Returns:
-    list: Frames where motion was detected [(frame_number, bounding_boxes), ...]
+    generator: (frame_number, frame, bounding_boxes, masks) for every frame, where frame is
+               the resized frame the boxes refer to and masks maps a window name to an
+               intermediate image (empty for the first frame)
     """
-    # Get all frame images and sort them
-    frame_paths = glob.glob(os.path.join(frames_directory, "frame_*.jpg"))
-    frame_paths.sort()
+    # Model the background per pixel, it adapts to lighting changes and camera motion
+    # instead of comparing every frame to the first one
+    background = cv2.createBackgroundSubtractorMOG2(history=200, varThreshold=25,
+                                                    detectShadows=False)
     
-    if len(frame_paths) == 0:
-        print("No frames found in the directory.")
-        return []
+    # With UMat inputs OpenCV runs every call below on the OpenCL device when there is one.
+    # The switch is stored per thread, so it is put back as it was once the frames are done
+    # and later OpenCV calls on this thread run as they did before
+    use_opencl_before = cv2.ocl.useOpenCL()
+    if use_opencl:
+        cv2.ocl.setUseOpenCL(True)
     
-    # Initialize the first frame in the sequence
-    firstFrame = None
-    results = []
-    
-    for i, frame_path in enumerate(frame_paths):
-        # Initialize the occupied/unoccupied text
-        text = "Unoccupied"
-        
-        # Read the current frame
-        frame = cv2.imread(frame_path)
+    try:
+        for n, (i, frame) in enumerate(frames):
+            # Resize the frame and convert it to grayscale, then blur and shrink it further
+            # with an image pyramid (each pyrDown is a 5x5 Gaussian followed by a 2x decimation)
+            h, w = frame.shape[:2]
+            if use_opencl:
+                frame = cv2.UMat(frame)
+            frame = cv2.resize(frame, (FRAME_WIDTH, h * FRAME_WIDTH // w), interpolation=cv2.INTER_AREA)
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            for _ in range(PYRAMID_LEVELS):
+                gray = cv2.pyrDown(gray)
+            # A 5x5 box blur at this scale smooths about as much as 21x21 on the full frame,
+            # motion detection only needs the low frequencies so a box filter is enough
+            gray = cv2.blur(gray, (5, 5))
         
-        if frame is None:
-            print(f"Could not read frame: {frame_path}")
-            continue
+            # Update the background model and get the foreground mask (0 or 255)
+            mask = background.apply(gray)
         
-        # Resize the frame, convert it to grayscale, and blur it
-        frame = imutils.resize(frame, width=500)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (21, 21), 0)
-        
-        # If the first frame is None, initialize it
-        if firstFrame is None:
-            firstFrame = gray
-            continue
-        
-        # Compute the absolute difference between the current frame and first frame
-        frameDelta = cv2.absdiff(firstFrame, gray)
-        thresh = cv2.threshold(frameDelta, 25, 255, cv2.THRESH_BINARY)[1]
+            # The whole first frame is foreground while the model initializes
+            if n == 0:
+                yield i, _to_array(frame), [], {}
+                continue
         
-        # Dilate the thresholded image to fill in holes, then find contours
-        thresh = cv2.dilate(thresh, None, iterations=2)
-        cnts = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        cnts = imutils.grab_contours(cnts)
+            # Dilate the mask to join the speckles into blobs, then find contours
+            # (findContours and the callers need the images back in host memory). The MOG2
+            # mask is sparser than a thresholded frame difference, so it takes two iterations
+            # where the difference only needed one
+            thresh = cv2.dilate(mask, None, iterations=2)
+            frame, mask, thresh = _to_array(frame), _to_array(mask), _to_array(thresh)
+            cnts = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
         
-        boxes = []
+            # Compute the bounding boxes of all the contours, back in frame coordinates
+            scale = 2 ** PYRAMID_LEVELS
+            rects = np.array([cv2.boundingRect(c) for c in cnts], dtype=np.int32).reshape(-1, 4) * scale
         
-        # Loop over the contours
-        for c in cnts:
-            # If the contour is too small, ignore it
-            if cv2.contourArea(c) < min_area:
-                continue
-                
-            # Compute the bounding box for the contour, draw it on the frame,
-            # and update the text
-            (x, y, w, h) = cv2.boundingRect(c)
-            boxes.append((x, y, w, h))
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            text = "Occupied"
+            # Ignore the boxes that are too small, using the box area as the contour's area
+            boxes = rects[rects[:, 2] * rects[:, 3] >= min_area].tolist()
         
+            yield i, frame, boxes, {"Thresh": thresh, "Foreground": mask}
+    finally:
+        cv2.ocl.setUseOpenCL(use_opencl_before)
+
+def detect_motion_in_frames(frames, min_area=500, display=True, use_opencl=False):
+    """
+    Process a sequence of frames to detect motion
+    
+    Parameters:
+    frames (str or iterable): Directory containing frame images (should be named in sequence),
+                              or an iterable of (frame_number, frame) such as stream_video()
+    min_area (int): Minimum contour area to be considered motion
+    display (bool): Whether to display the processed frames
+    use_opencl (bool): Whether to run the pixel operations on the GPU through OpenCL
+    
+    Returns:
+    list: Frames where motion was detected [(frame_number, bounding_boxes), ...]
+    """
+    # Read the frames back from disk when given a directory
+    if isinstance(frames, str):
+        frames = read_frames(frames)
+    
+    results = []
+    
+    for i, frame, boxes, masks in iter_motion(frames, min_area, use_opencl):
         # If motion was detected in this frame, add it to results
-        if text == "Occupied":
-            frame_number = i
-            results.append((frame_number, boxes))
+        text = "Occupied" if boxes else "Unoccupied"
+        if boxes:
+            results.append((i, boxes))
             
         if display:
-            # Draw the text and timestamp on the frame
+            # Draw the boxes, the text and timestamp on the frame
+            for (x, y, w, h) in boxes:
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
             cv2.putText(frame, f"Room Status: {text}", (10, 20),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-            cv2.putText(frame, f"Frame: {i} - {os.path.basename(frame_path)}",
+            cv2.putText(frame, f"Frame: {i}",
                 (10, frame.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 255), 1)
                 
             # Show the frame and record if the user presses a key
             cv2.imshow("Security Feed", frame)
-            cv2.imshow("Thresh", thresh)
-            cv2.imshow("Frame Delta", frameDelta)
+            for name, mask in masks.items():
+                cv2.imshow(name, mask)
             key = cv2.waitKey(25) & 0xFF  # Slight delay to control "playback" speed
             
             # If the 'q' key is pressed, break from the loop
@@ -106,12 +137,15 @@ def detect_motion_in_frames(frames_directory, min_area=500, display=True):
 
 def save_results(results, output_path="motion_results.txt"):
     """Save motion detection results to a file"""
+    # Build the whole report in memory and write it in one go
+    buf = io.StringIO()
+    buf.write(f"Motion detected in {len(results)} frames\n")
+    for frame_num, boxes in results:
+        buf.write(f"Frame {frame_num}: {len(boxes)} objects detected\n")
+        buf.writelines(f"  Object {i+1}: x={x}, y={y}, width={w}, height={h}\n"
+                       for i, (x, y, w, h) in enumerate(boxes))
     with open(output_path, 'w') as f:
-        f.write(f"Motion detected in {len(results)} frames\n")
-        for frame_num, boxes in results:
-            f.write(f"Frame {frame_num}: {len(boxes)} objects detected\n")
-            for i, (x, y, w, h) in enumerate(boxes):
-                f.write(f"  Object {i+1}: x={x}, y={y}, width={w}, height={h}\n")
+        f.write(buf.getvalue())
     print(f"Results saved to {output_path}")
 
 if __name__ == "__main__":
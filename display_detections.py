@@ -1,56 +1,44 @@
 import cv2
 import datetime
+import os
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
-def blur_region(image, x, y, w, h, blur_method='gaussian', blur_strength=25):
-    """
-    Apply blurring to a specific region in the image
-    
-    Parameters:
-    image (numpy.ndarray): The image to blur
-    x, y, w, h (int): Region coordinates and dimensions
-    blur_method (str): Blurring method it can be ('gaussian', 'median', 'pixelate', 'box')
-    blur_strength (int): Strength/kernel size of blur effect
-    
-    Returns:
-    numpy.ndarray: The image with the blurred region
-    """
-    # Make sure coordinates are within image bounds
-    x, y = max(0, x), max(0, y)
-    right = min(image.shape[1], x + w)
-    bottom = min(image.shape[0], y + h)
-    
-    # Extract the region to blur
-    region = image[y:bottom, x:right].copy()
-    
-    # Apply the selected blur method
-    if blur_method == 'gaussian':
-        # Ensure kernel size is odd
-        k_size = blur_strength if blur_strength % 2 == 1 else blur_strength + 1
-        blurred_region = cv2.GaussianBlur(region, (k_size, k_size), 0)
-    elif blur_method == 'median':
-        k_size = blur_strength if blur_strength % 2 == 1 else blur_strength + 1
-        blurred_region = cv2.medianBlur(region, k_size)
-    elif blur_method == 'pixelate':
-        # Pixelation effect by downsampling and upsampling
-        scale = max(1, blur_strength // 10)  # Adjust scale based on strength
-        small = cv2.resize(region, (w // scale, h // scale), interpolation=cv2.INTER_LINEAR)
-        blurred_region = cv2.resize(small, (w, h), interpolation=cv2.INTER_NEAREST)
-    elif blur_method == 'box':
-        k_size = blur_strength if blur_strength % 2 == 1 else blur_strength + 1
-        blurred_region = cv2.blur(region, (k_size, k_size))
-    else:
-        # Default to Gaussian if method not recognized
-        k_size = blur_strength if blur_strength % 2 == 1 else blur_strength + 1
-        blurred_region = cv2.GaussianBlur(region, (k_size, k_size), 0)
-    
-    # Replace the region in the original image
-    image[y:bottom, x:right] = blurred_region
-    
-    return image
+# Cores this process may run on, the affinity mask can be smaller than os.cpu_count()
+_CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+# Blurs release the GIL, so the regions of a frame can be blurred concurrently
+_blur_pool = ThreadPoolExecutor(max_workers=_CPU_COUNT) if _CPU_COUNT > 1 else None
+# Handing a region to the pool costs about 20us while a 25x25 Gaussian takes 150us on a
+# 20x20 region and about 0.8ms on 100x100, so the pool pays off from a few regions of
+# moderate size on; frames with less to blur are blurred inline
+_MIN_POOL_AREA = 10_000
+
+def _pixelate(region, k_size):
+    """Pixelation effect by downsampling and upsampling"""
+    scale = max(1, k_size // 10)  # Adjust scale based on strength
+    h, w = region.shape[:2]
+    small = cv2.resize(region, (max(1, w // scale), max(1, h // scale)), interpolation=cv2.INTER_LINEAR)
+    return cv2.resize(small, (w, h), interpolation=cv2.INTER_NEAREST)
+
+# Blur functions by method name, each one takes an odd kernel size and returns a function
+# blurring a region, bound straight to the OpenCV call so no Python frame runs per region
+_BLUR_FNS = {
+    'gaussian': lambda k_size: partial(cv2.GaussianBlur, ksize=(k_size, k_size), sigmaX=0),
+    'median': lambda k_size: partial(cv2.medianBlur, ksize=k_size),
+    'box': lambda k_size: partial(cv2.blur, ksize=(k_size, k_size)),
+    'pixelate': lambda k_size: partial(_pixelate, k_size=k_size),
+}
+
+def _get_blur(blur_method='gaussian', blur_strength=25):
+    """Return a function blurring a region with the given method and strength"""
+    # Default to Gaussian if method not recognized
+    make_blur = _BLUR_FNS.get(blur_method, _BLUR_FNS['gaussian'])
+    # Ensure kernel size is odd
+    return make_blur(blur_strength | 1)
 
 def display_detections(frame, detections, display_time=True, wait_time=1, blur=True, 
-                       blur_method='gaussian', blur_strength=25, draw_boxes=True):
+                       blur_method='gaussian', blur_strength=25, draw_boxes=True, inplace=True):
     """
     Display a frame with detection boxes, timestamp, and optional blurring
     
@@ -63,21 +51,43 @@ def display_detections(frame, detections, display_time=True, wait_time=1, blur=T
     blur_method (str): Method for blurring ('gaussian', 'median', 'pixelate', 'box')
     blur_strength (int): Strength of the blur effect (kernel size)
     draw_boxes (bool): Whether to draw bounding boxes around detections
+    inplace (bool): Whether to draw directly on frame instead of on a copy of it
     
     Returns:
     numpy.ndarray: The processed frame with detections and timestamp
     int: Key pressed during display
     """
-    # Make a copy of the frame to avoid modifying the original
-    display_frame = frame.copy()
-    
-    # Draw each detection box
-    for (x, y, w, h) in detections:
-        if blur:
-            display_frame = blur_region(display_frame, x, y, w, h, blur_method, blur_strength)
-        
-        # Draw detection box if requested
-        if draw_boxes:
+    # Draw on the frame itself unless the caller still needs the original
+    display_frame = frame if inplace else frame.copy()
+    
+    # Clip all the boxes to the image bounds at once
+    boxes = np.asarray(detections, dtype=np.int32).reshape(-1, 4)
+    height, width = display_frame.shape[:2]
+    x0 = np.clip(boxes[:, 0], 0, width)
+    y0 = np.clip(boxes[:, 1], 0, height)
+    x1 = np.clip(boxes[:, 0] + boxes[:, 2], 0, width)
+    y1 = np.clip(boxes[:, 1] + boxes[:, 3], 0, height)
+    
+    # Blur the boxes that still cover part of the image once clipped. Every region is
+    # blurred from the untouched frame, then all of them are pasted, so overlapping boxes
+    # are blurred once and the result doesn't depend on whether the thread pool is used
+    if blur:
+        # Pick the blur function once for all the boxes
+        blur_fn = _get_blur(blur_method, blur_strength)
+        visible = (x1 > x0) & (y1 > y0)
+        area = int(((x1 - x0) * (y1 - y0))[visible].sum())
+        regions = np.stack([x0, y0, x1, y1], axis=1)[visible].tolist()
+        views = [display_frame[ry0:ry1, rx0:rx1] for rx0, ry0, rx1, ry1 in regions]
+        if _blur_pool is not None and len(regions) > 1 and area >= _MIN_POOL_AREA:
+            blurred = list(_blur_pool.map(blur_fn, views))
+        else:
+            blurred = [blur_fn(view) for view in views]
+        for (rx0, ry0, rx1, ry1), blurred_region in zip(regions, blurred):
+            display_frame[ry0:ry1, rx0:rx1] = blurred_region
+    
+    # Draw detection boxes if requested
+    if draw_boxes:
+        for (x, y, w, h) in boxes.tolist():
             cv2.rectangle(display_frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
     
     # Add current time in the top left corner
@@ -95,24 +105,47 @@ def display_detections(frame, detections, display_time=True, wait_time=1, blur=T
     # Return the processed frame and key press
     return display_frame, key
 
+def open_video_writer(save_output, frame, fps=30.0):
+    """
+    Open a video writer sized for the given frame, using a hardware encoder when possible
+    
+    Parameters:
+    save_output (str): Path to save the output video
+    frame (numpy.ndarray): A frame with the size of the output video
+    fps (float): Frame rate of the output video
+    
+    Returns:
+    cv2.VideoWriter: The opened video writer
+    """
+    height, width = frame.shape[:2]
+    
+    # Prefer H.264 through FFmpeg, encoded on the GPU (NVENC, QSV, ...) when available
+    if hasattr(cv2, "VIDEOWRITER_PROP_HW_ACCELERATION"):
+        out = cv2.VideoWriter(save_output, cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*'H264'), fps,
+                              (width, height),
+                              [cv2.VIDEOWRITER_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if out.isOpened():
+            return out
+    
+    # Fall back to software MPEG-4
+    fourcc = cv2.VideoWriter_fourcc(*'XVID')
+    return cv2.VideoWriter(save_output, fourcc, fps, (width, height))
+
 def run_display(frames, detection_results, save_output=None, wait_time=25):
     """
     Run the display on a set of frames with their detection results
     
     Parameters:
-    frames (list): List of frame images
-    detection_results (list): List of detection boxes for each frame
+    frames (iterable): Frame images, any iterable so the frames can be loaded lazily
+    detection_results (dict): Detection boxes for each frame number
     save_output (str): Path to save the output video (None to not save)
     wait_time (int): Time to wait between frames in milliseconds
     
     Returns:
     None
     """
-    # Initialize video writer if saving output
-    if save_output:
-        height, width = frames[0].shape[:2]
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        out = cv2.VideoWriter(save_output, fourcc, 30.0, (width, height))
+    # The video writer is opened on the first frame, once its size is known
+    out = None
     
     # Process each frame
     for i, frame in enumerate(frames):
@@ -124,6 +157,8 @@ def run_display(frames, detection_results, save_output=None, wait_time=25):
         
         # Save the processed frame if required
         if save_output:
+            if out is None:
+                out = open_video_writer(save_output, processed_frame)
             out.write(processed_frame)
         
         
@@ -131,7 +166,7 @@ def run_display(frames, detection_results, save_output=None, wait_time=25):
             break
     
     
-    if save_output:
+    if out is not None:
         out.release()
     cv2.destroyAllWindows()
 
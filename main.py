@@ -1,23 +1,25 @@
-import cv2
-from detector import detect_motion_in_frames
-from display_detections import display_detections
+import argparse
+from Streamer import stream_video, extract_frames, read_frames
+from pipeline import run_pipeline
 
-# Load your frames
-frames_dir = "frames_opencv/dog_video.MP4"
-results = detect_motion_in_frames(frames_dir, min_area=500, display=False)
-
-# Convert results to format needed by display function
-detection_dict = {}
-for frame_num, boxes in results:
-    detection_dict[frame_num] = boxes
-
-# Load the original frames
-import glob
-import os
-frame_paths = sorted(glob.glob(os.path.join(frames_dir, "frame_*.jpg")))
-frames = [cv2.imread(fp) for fp in frame_paths]
-
-# Display frames with detections
-from display_detections import run_display
-run_display(frames, detection_dict)
+# The guard is needed by the frame extraction worker processes
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect and display motion in a video")
+    parser.add_argument("video", nargs="?", default="dog_video.MP4", help="Path to the video file")
+    parser.add_argument("--persist", action="store_true",
+                        help="Save the frames as JPEGs under frames_opencv and process them from disk")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes extracting frames with --persist (0 to use every core)")
+    parser.add_argument("--opencl", action="store_true",
+                        help="Run the motion detection pixel operations on the GPU through OpenCL")
+    args = parser.parse_args()
 
+    if args.persist:
+        # Extract the frames to disk, then detect and display from the saved frames
+        frames = read_frames(extract_frames(args.video, workers=args.workers))
+    else:
+        # Decode straight from the video, nothing is written to disk
+        frames = stream_video(args.video)
+    
+    # Decode, detect and display concurrently, the display reuses the detector's frames
+    results = run_pipeline(frames, min_area=500, use_opencl=args.opencl)
@@ -0,0 +1,128 @@
+import queue
+import threading
+import cv2
+from detector import iter_motion
+from display_detections import display_detections, open_video_writer
+
+# Marks the end of the stream in the queues
+_SENTINEL = None
+
+
+def _put(q, item, stop):
+    """Put an item on a bounded queue, giving up once the pipeline is stopped"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(q, stop):
+    """Yield items from a queue until the sentinel is received or the pipeline is stopped"""
+    while True:
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        if item is _SENTINEL:
+            return
+        yield item
+
+
+def _read_stage(frames, read_q, stop, errors):
+    """Reader thread: decode frames and push (frame_number, frame) to read_q"""
+    try:
+        for item in frames:
+            if not _put(read_q, item, stop):
+                break
+    except Exception as e:
+        errors.append(e)
+    finally:
+        # Close the source right away so it releases its capture, even when stopped early
+        if hasattr(frames, "close"):
+            frames.close()
+        _put(read_q, _SENTINEL, stop)
+
+
+def _detect_stage(read_q, write_q, stop, errors, results, min_area, use_opencl):
+    """Detector thread: find motion in the frames from read_q and push them to write_q"""
+    motion = iter_motion(_drain(read_q, stop), min_area, use_opencl)
+    try:
+        for frame_number, frame, boxes, _ in motion:
+            if boxes:
+                results.append((frame_number, boxes))
+            if not _put(write_q, (frame_number, frame, boxes), stop):
+                break
+    except Exception as e:
+        errors.append(e)
+    finally:
+        # Finish the detector on this thread rather than whenever it is garbage collected
+        motion.close()
+        _put(write_q, _SENTINEL, stop)
+
+
+def run_pipeline(frames, min_area=500, prefetch=16, save_output=None, wait_time=25,
+                 use_opencl=False):
+    """
+    Decode, detect and display frames in three overlapping stages
+
+    The reader and the detector run on their own threads and the display runs on the
+    calling thread, since HighGUI windows must be created and polled from the main thread.
+    The stages exchange frames through bounded queues so a slow stage holds back the
+    others instead of piling up frames in memory.
+
+    Parameters:
+    frames (iterable): (frame_number, frame) pairs such as stream_video() or read_frames()
+    min_area (int): Minimum contour area to be considered motion
+    prefetch (int): Maximum number of frames waiting between two stages, which is also
+                    how many frames the reader decodes or loads ahead of the detector
+    save_output (str): Path to save the output video (None to not save)
+    wait_time (int): Time to wait between frames in milliseconds
+    use_opencl (bool): Whether the detector runs its pixel operations through OpenCL
+
+    Returns:
+    list: Frames where motion was detected [(frame_number, bounding_boxes), ...]
+    """
+    read_q = queue.Queue(maxsize=prefetch)
+    write_q = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    errors = []
+    results = []
+
+    reader = threading.Thread(target=_read_stage, args=(frames, read_q, stop, errors), daemon=True)
+    detector = threading.Thread(target=_detect_stage,
+                                args=(read_q, write_q, stop, errors, results, min_area, use_opencl),
+                                daemon=True)
+    reader.start()
+    detector.start()
+
+    out = None
+    try:
+        for frame_number, frame, boxes in _drain(write_q, stop):
+            processed_frame, key = display_detections(frame, boxes, wait_time=wait_time)
+
+            # Save the processed frame if required
+            if save_output:
+                if out is None:
+                    out = open_video_writer(save_output, processed_frame)
+                out.write(processed_frame)
+
+            if key == ord('q'):
+                break
+    finally:
+        # Tell the other stages to stop
+        stop.set()
+        detector.join()
+        reader.join()
+        if out is not None:
+            out.release()
+        cv2.destroyAllWindows()
+
+    if errors:
+        raise errors[0]
+
+    return results